@@ -1,11 +1,7 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, request
 from flask_cors import CORS
-import pandas as pd
-import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
-import os
+import orjson
+from functools import wraps
 from data_service import DataService
 
 # Initialize Flask app
@@ -15,40 +11,66 @@ CORS(app)  # Enable CORS for all routes
 # Initialize data service
 data_service = DataService()
 
+def ojson(obj, status=200):
+    """Build a JSON response with orjson, which also encodes NumPy values natively"""
+    return Response(
+        orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY),
+        status=status,
+        mimetype='application/json'
+    )
+
+def requires_data(view):
+    """Answer with a 500 error instead of calling `view` when no dataset is loaded"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if data_service.df is None or data_service.df.empty:
+            return ojson({
+                'status': 'error',
+                'message': 'No data available'
+            }, 500)
+        return view(*args, **kwargs)
+    return wrapper
+
+def ojson_stream(envelope, key, df, chunk_size=1024):
+    """Stream a JSON object holding `envelope` plus `df`'s rows as records under `key`"""
+    # Reopen the encoded envelope object to append the records array
+    head = orjson.dumps(envelope)[:-1] + b',' + orjson.dumps(key) + b':['
+    
+    def generate():
+        yield head
+        for start in range(0, len(df), chunk_size):
+            records = df.iloc[start:start + chunk_size].to_dict(orient='records')
+            if start:
+                yield b','
+            # Drop the brackets so consecutive chunks join into one array
+            yield orjson.dumps(records, option=orjson.OPT_SERIALIZE_NUMPY)[1:-1]
+        yield b']}'
+    
+    return Response(generate(), mimetype='application/json')
+
+# The dataset is read-only after startup, so the metadata payload is serialized once
+METADATA_JSON = None
+if data_service.df is not None and not data_service.df.empty:
+    METADATA_JSON = orjson.dumps({
+        'status': 'success',
+        **data_service.get_metadata()
+    }, option=orjson.OPT_SERIALIZE_NUMPY)
+
 @app.route('/api/metadata', methods=['GET'])
 def get_metadata():
     """Return metadata about the dataset"""
-    if data_service.df is None or data_service.df.empty:
-        return jsonify({
+    if METADATA_JSON is None:
+        return ojson({
             'status': 'error',
             'message': 'No data available'
-        }), 500
+        }, 500)
     
-    return jsonify({
-        'status': 'success',
-        'total_records': len(data_service.df),
-        'active_ingredients': data_service.df['principio_activo'].dropna().unique().tolist(),
-        'manufacturers': data_service.df['fabricante'].dropna().unique().tolist(),
-        'concentrations': data_service.df['concentracion'].dropna().unique().tolist(),
-        'channels': data_service.df['canal'].dropna().unique().tolist(),
-        'dispensing_units': data_service.df['unidad_de_dispensacion'].dropna().unique().tolist(),
-        'price_range': {
-            'min': float(data_service.df['precio_por_tableta'].min()),
-            'max': float(data_service.df['precio_por_tableta'].max()),
-            'avg': float(data_service.df['precio_por_tableta'].mean())
-        },
-        'columns': data_service.df.columns.tolist()
-    })
+    return Response(METADATA_JSON, mimetype='application/json')
 
 @app.route('/api/data', methods=['GET'])
+@requires_data
 def get_data():
     """Return filtered data based on query parameters"""
-    if data_service.df is None or data_service.df.empty:
-        return jsonify({
-            'status': 'error',
-            'message': 'No data available'
-        }), 500
-    
     # Get filter parameters
     active_ingredient = request.args.get('active_ingredient')
     manufacturer = request.args.get('manufacturer')
@@ -75,24 +97,16 @@ def get_data():
         limit=limit
     )
     
-    # Convert to JSON-compatible format
-    result = filtered_df.to_dict(orient='records')
-    
-    return jsonify({
+    # Stream the rows so large limits never hold the whole payload in memory
+    return ojson_stream({
         'status': 'success',
-        'count': len(result),
-        'data': result
-    })
+        'count': len(filtered_df)
+    }, 'data', filtered_df)
 
 @app.route('/api/summary', methods=['GET'])
+@requires_data
 def get_summary():
     """Return summary statistics based on filters"""
-    if data_service.df is None or data_service.df.empty:
-        return jsonify({
-            'status': 'error',
-            'message': 'No data available'
-        }), 500
-        
     # Get filter parameters
     active_ingredient = request.args.get('active_ingredient')
     manufacturer = request.args.get('manufacturer')
@@ -100,20 +114,15 @@ def get_summary():
     # Get stats
     stats = data_service.get_summary_stats(active_ingredient, manufacturer)
     
-    return jsonify({
+    return ojson({
         'status': 'success',
         'summary': stats
     })
 
 @app.route('/api/histogram', methods=['GET'])
+@requires_data
 def get_histogram():
     """Return histogram data for prices"""
-    if data_service.df is None or data_service.df.empty:
-        return jsonify({
-            'status': 'error',
-            'message': 'No data available'
-        }), 500
-    
     # Get filter parameters
     active_ingredient = request.args.get('active_ingredient')
     manufacturer = request.args.get('manufacturer')
@@ -122,20 +131,15 @@ def get_histogram():
     # Get histogram data
     histogram_data = data_service.get_histogram_data(active_ingredient, manufacturer, bins)
     
-    return jsonify({
+    return ojson({
         'status': 'success',
         'histogram': histogram_data
     })
 
 @app.route('/api/boxplot', methods=['GET'])
+@requires_data
 def get_boxplot():
     """Return boxplot data grouped by a specific column"""
-    if data_service.df is None or data_service.df.empty:
-        return jsonify({
-            'status': 'error',
-            'message': 'No data available'
-        }), 500
-    
     # Get parameters
     group_by = request.args.get('group_by', 'fabricante')
     active_ingredient = request.args.get('active_ingredient')
@@ -145,27 +149,47 @@ def get_boxplot():
     boxplot_data = data_service.get_boxplot_data(group_by, active_ingredient, limit)
     
     if isinstance(boxplot_data, dict) and 'error' in boxplot_data:
-        return jsonify({
+        return ojson({
             'status': 'error',
             'message': boxplot_data['error']
-        }), 400
+        }, 400)
     
-    return jsonify({
+    return ojson({
         'status': 'success',
         'boxplot': boxplot_data
     })
 
+@app.route('/api/analysis', methods=['GET'])
+@requires_data
+def get_analysis():
+    """Return summary statistics, histogram and boxplot data for the same filters"""
+    # Get parameters
+    active_ingredient = request.args.get('active_ingredient')
+    manufacturer = request.args.get('manufacturer')
+    bins = request.args.get('bins', 10, type=int)
+    group_by = request.args.get('group_by', 'fabricante')
+    limit = request.args.get('limit', 10, type=int)
+    
+    # Filter once and compute all three analyses on the result
+    analysis = data_service.analyze(active_ingredient, manufacturer, bins, group_by, limit)
+    
+    if 'error' in analysis:
+        return ojson({
+            'status': 'error',
+            'message': analysis['error']
+        }, 400)
+    
+    return ojson({
+        'status': 'success',
+        **analysis
+    })
+
 # Machine Learning Endpoints
 
 @app.route('/api/ml/clusters', methods=['GET'])
+@requires_data
 def get_clusters():
     """Perform k-means clustering on the data"""
-    if data_service.df is None or data_service.df.empty:
-        return jsonify({
-            'status': 'error',
-            'message': 'No data available'
-        }), 500
-    
     # Get parameters
     active_ingredient = request.args.get('active_ingredient')
     n_clusters = request.args.get('n_clusters', 3, type=int)
@@ -173,21 +197,16 @@ def get_clusters():
     # Get clustering results
     clustering_results = data_service.get_clustering(active_ingredient, n_clusters)
     
-    return jsonify({
+    return ojson({
         'status': 'success',
         'clusters': clustering_results['cluster_stats'],
         'data_sample': clustering_results['data_sample']
     })
 
 @app.route('/api/ml/anomalies', methods=['GET'])
+@requires_data
 def get_anomalies():
-    """Detect price anomalies using Isolation Forest"""
-    if data_service.df is None or data_service.df.empty:
-        return jsonify({
-            'status': 'error',
-            'message': 'No data available'
-        }), 500
-    
+    """Detect price anomalies outside the interquartile range fences"""
     # Get parameters
     active_ingredient = request.args.get('active_ingredient')
     contamination = request.args.get('contamination', 0.05, type=float)
@@ -195,7 +214,7 @@ def get_anomalies():
     # Get anomaly detection results
     anomaly_results = data_service.get_anomalies(active_ingredient, contamination)
     
-    return jsonify({
+    return ojson({
         'status': 'success',
         'statistics': anomaly_results['stats'],
         'anomalies': anomaly_results['anomaly_data']
@@ -2,20 +2,49 @@ import dash
 from dash import dcc, html, Input, Output, State, dash_table
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import io
+from functools import lru_cache
 from data_service import DataService
 
+# Dash encodes callback responses through Plotly's JSON encoder; use orjson for
+# it rather than falling back to the stdlib json module
+pio.json.config.default_engine = 'orjson'
+
 # Initialize data service
 data_service = DataService()
 df = data_service.df
 
-# Get unique values for dropdowns
-active_ingredients = sorted(df['principio_activo'].dropna().unique())
-manufacturers = sorted(df['fabricante'].dropna().unique())
-concentrations = sorted(df['concentracion'].dropna().unique())
-channels = sorted(df['canal'].dropna().unique())
-dispensing_units = sorted(df['unidad_de_dispensacion'].dropna().unique())
+# Get unique values for dropdowns (the data service stores these columns as
+# categoricals, whose categories are already the sorted distinct values)
+active_ingredients = df['principio_activo'].cat.categories.tolist()
+manufacturers = df['fabricante'].cat.categories.tolist()
+concentrations = df['concentracion'].cat.categories.tolist()
+channels = df['canal'].cat.categories.tolist()
+dispensing_units = df['unidad_de_dispensacion'].cat.categories.tolist()
+
+# Category codes of the box plot's group columns, most frequent overall first
+GROUP_RANKING = {
+    column: np.argsort(-np.bincount(df[column].cat.codes.to_numpy() + 1,
+                                    minlength=len(df[column].cat.categories) + 1)[1:], kind='stable')
+    for column in ('fabricante', 'principio_activo')
+}
+
+# Dropdown options, built once for the layout
+AI_OPTIONS = [{'label': 'All Active Ingredients', 'value': 'all'}] + [{'label': v, 'value': v} for v in active_ingredients]
+MANUFACTURER_OPTIONS = [{'label': 'All Manufacturers', 'value': 'all'}] + [{'label': v, 'value': v} for v in manufacturers]
+CONCENTRATION_OPTIONS = [{'label': 'All Concentrations', 'value': 'all'}] + [{'label': v, 'value': v} for v in concentrations]
+CHANNEL_OPTIONS = [{'label': 'All Channels', 'value': 'all'}] + [{'label': v, 'value': v} for v in channels]
+
+# Overall price statistics used by the layout and the filter reset
+_price_stats = df['precio_por_tableta'].agg(['min', 'max', 'mean'])
+PRICE_MIN = float(_price_stats['min'])
+PRICE_MAX = float(_price_stats['max'])
+PRICE_MEAN = float(_price_stats['mean'])
 
 # Initialize the Dash app
 app = dash.Dash(__name__, 
@@ -24,311 +53,317 @@ app = dash.Dash(__name__,
                     'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css'
                 ])
 
-# Define the layout
-app.layout = html.Div([
-    # Navigation bar
-    html.Nav([
-        html.Div([
-            html.A([
-                html.I(className="bi bi-capsule me-2"),
-                "PharmaLens"
-            ], className="navbar-brand", href="#"),
-            html.Button([
-                html.Span(className="navbar-toggler-icon")
-            ], className="navbar-toggler", **{
-                'data-bs-toggle': 'collapse',
-                'data-bs-target': '#navbarNav',
-                'aria-controls': 'navbarNav',
-                'aria-expanded': 'false',
-                'aria-label': 'Toggle navigation'
-            }),
+# Function to build the layout, memoized so the component tree is only built once
+# per process however often Dash asks for it
+@lru_cache(maxsize=1)
+def build_layout():
+    return html.Div([
+        # Navigation bar
+        html.Nav([
             html.Div([
-                html.Ul([
-                    html.Li([
-                        html.A("Dashboard", className="nav-link", href="#")
-                    ], className="nav-item"),
-                    html.Li([
-                        html.A("Anomaly Detection", className="nav-link", href="#anomaly-tab")
-                    ], className="nav-item"),
-                    html.Li([
-                        html.A("Clustering", className="nav-link", href="#clustering-tab")
-                    ], className="nav-item")
-                ], className="navbar-nav"),
-            ], className="collapse navbar-collapse", id="navbarNav")
-        ], className="container-fluid")
-    ], className="navbar navbar-expand-lg navbar-light bg-white shadow-sm"),
+                html.A([
+                    html.I(className="bi bi-capsule me-2"),
+                    "PharmaLens"
+                ], className="navbar-brand", href="#"),
+                html.Button([
+                    html.Span(className="navbar-toggler-icon")
+                ], className="navbar-toggler", **{
+                    'data-bs-toggle': 'collapse',
+                    'data-bs-target': '#navbarNav',
+                    'aria-controls': 'navbarNav',
+                    'aria-expanded': 'false',
+                    'aria-label': 'Toggle navigation'
+                }),
+                html.Div([
+                    html.Ul([
+                        html.Li([
+                            html.A("Dashboard", className="nav-link", href="#")
+                        ], className="nav-item"),
+                        html.Li([
+                            html.A("Anomaly Detection", className="nav-link", href="#anomaly-tab")
+                        ], className="nav-item"),
+                        html.Li([
+                            html.A("Clustering", className="nav-link", href="#clustering-tab")
+                        ], className="nav-item")
+                    ], className="navbar-nav"),
+                ], className="collapse navbar-collapse", id="navbarNav")
+            ], className="container-fluid")
+        ], className="navbar navbar-expand-lg navbar-light bg-white shadow-sm"),
     
-    # Main container
-    html.Div([
-        # Dashboard header
+        # Main container
         html.Div([
+            # Dashboard header
             html.Div([
                 html.Div([
                     html.Div([
-                        html.H4("Drug Price Analysis Dashboard", className="mb-0")
-                    ], className="card-header bg-primary text-white"),
-                    html.Div([
-                        # Summary statistics cards
                         html.Div([
+                            html.H4("Drug Price Analysis Dashboard", className="mb-0")
+                        ], className="card-header bg-primary text-white"),
+                        html.Div([
+                            # Summary statistics cards
                             html.Div([
                                 html.Div([
                                     html.Div([
-                                        html.H6("Total Records", className="card-title text-muted"),
-                                        html.H2(f"{len(df)}", className="card-text")
-                                    ], className="card-body text-center")
-                                ], className="card bg-light mb-3")
-                            ], className="col-md-3"),
-                            html.Div([
+                                        html.Div([
+                                            html.H6("Total Records", className="card-title text-muted"),
+                                            html.H2(f"{len(df)}", className="card-text")
+                                        ], className="card-body text-center")
+                                    ], className="card bg-light mb-3")
+                                ], className="col-md-3"),
                                 html.Div([
                                     html.Div([
-                                        html.H6("Average Price", className="card-title text-muted"),
-                                        html.H2(f"${df['precio_por_tableta'].mean():.2f}", className="card-text")
-                                    ], className="card-body text-center")
-                                ], className="card bg-light mb-3")
-                            ], className="col-md-3"),
-                            html.Div([
+                                        html.Div([
+                                            html.H6("Average Price", className="card-title text-muted"),
+                                            html.H2(f"${PRICE_MEAN:.2f}", className="card-text")
+                                        ], className="card-body text-center")
+                                    ], className="card bg-light mb-3")
+                                ], className="col-md-3"),
                                 html.Div([
                                     html.Div([
-                                        html.H6("Price Range", className="card-title text-muted"),
-                                        html.H2(f"${df['precio_por_tableta'].min():.2f} - ${df['precio_por_tableta'].max():.2f}", className="card-text")
-                                    ], className="card-body text-center")
-                                ], className="card bg-light mb-3")
-                            ], className="col-md-3"),
-                            html.Div([
+                                        html.Div([
+                                            html.H6("Price Range", className="card-title text-muted"),
+                                            html.H2(f"${PRICE_MIN:.2f} - ${PRICE_MAX:.2f}", className="card-text")
+                                        ], className="card-body text-center")
+                                    ], className="card bg-light mb-3")
+                                ], className="col-md-3"),
                                 html.Div([
                                     html.Div([
-                                        html.H6("Active Ingredients", className="card-title text-muted"),
-                                        html.H2(f"{len(active_ingredients)}", className="card-text")
-                                    ], className="card-body text-center")
-                                ], className="card bg-light mb-3")
-                            ], className="col-md-3")
-                        ], className="row")
-                    ], className="card-body")
-                ], className="card shadow")
-            ], className="col-12")
-        ], className="row mb-3"),
+                                        html.Div([
+                                            html.H6("Active Ingredients", className="card-title text-muted"),
+                                            html.H2(f"{len(active_ingredients)}", className="card-text")
+                                        ], className="card-body text-center")
+                                    ], className="card bg-light mb-3")
+                                ], className="col-md-3")
+                            ], className="row")
+                        ], className="card-body")
+                    ], className="card shadow")
+                ], className="col-12")
+            ], className="row mb-3"),
         
-        # Filters
-        html.Div([
+            # Filters
             html.Div([
                 html.Div([
-                    html.Div([
-                        html.H5("Filters", className="mb-0")
-                    ], className="card-header"),
                     html.Div([
                         html.Div([
-                            # First row of filters
+                            html.H5("Filters", className="mb-0")
+                        ], className="card-header"),
+                        html.Div([
                             html.Div([
+                                # First row of filters
                                 html.Div([
-                                    html.Label("Active Ingredient", className="form-label"),
-                                    dcc.Dropdown(
-                                        id='active-ingredient',
-                                        options=[{'label': 'All Active Ingredients', 'value': 'all'}] + 
-                                                [{'label': i, 'value': i} for i in active_ingredients],
-                                        value='all',
-                                        className="form-select"
-                                    )
-                                ], className="col-md-4"),
-                                html.Div([
-                                    html.Label("Manufacturer", className="form-label"),
-                                    dcc.Dropdown(
-                                        id='manufacturer',
-                                        options=[{'label': 'All Manufacturers', 'value': 'all'}] + 
-                                                [{'label': m, 'value': m} for m in manufacturers],
-                                        value='all',
-                                        className="form-select"
-                                    )
-                                ], className="col-md-4"),
-                                html.Div([
-                                    html.Label("Concentration", className="form-label"),
-                                    dcc.Dropdown(
-                                        id='concentration',
-                                        options=[{'label': 'All Concentrations', 'value': 'all'}] + 
-                                                [{'label': c, 'value': c} for c in concentrations],
-                                        value='all',
-                                        className="form-select"
-                                    )
-                                ], className="col-md-4")
-                            ], className="row g-3 mb-3"),
+                                    html.Div([
+                                        html.Label("Active Ingredient", className="form-label"),
+                                        dcc.Dropdown(
+                                            id='active-ingredient',
+                                            options=AI_OPTIONS,
+                                            value='all',
+                                            className="form-select"
+                                        )
+                                    ], className="col-md-4"),
+                                    html.Div([
+                                        html.Label("Manufacturer", className="form-label"),
+                                        dcc.Dropdown(
+                                            id='manufacturer',
+                                            options=MANUFACTURER_OPTIONS,
+                                            value='all',
+                                            className="form-select"
+                                        )
+                                    ], className="col-md-4"),
+                                    html.Div([
+                                        html.Label("Concentration", className="form-label"),
+                                        dcc.Dropdown(
+                                            id='concentration',
+                                            options=CONCENTRATION_OPTIONS,
+                                            value='all',
+                                            className="form-select"
+                                        )
+                                    ], className="col-md-4")
+                                ], className="row g-3 mb-3"),
                             
-                            # Second row of filters
-                            html.Div([
-                                html.Div([
-                                    html.Label("Distribution Channel", className="form-label"),
-                                    dcc.Dropdown(
-                                        id='channel',
-                                        options=[{'label': 'All Channels', 'value': 'all'}] + 
-                                                [{'label': c, 'value': c} for c in channels],
-                                        value='all',
-                                        className="form-select"
-                                    )
-                                ], className="col-md-4"),
-                                html.Div([
-                                    html.Label("Price Range", className="form-label"),
-                                    dcc.RangeSlider(
-                                        id='price-range',
-                                        min=0,
-                                        max=df['precio_por_tableta'].max(),
-                                        value=[0, df['precio_por_tableta'].max()],
-                                        marks={0: '$0', int(df['precio_por_tableta'].max()): f'${int(df["precio_por_tableta"].max())}'},
-                                        tooltip={"placement": "bottom", "always_visible": True}
-                                    )
-                                ], className="col-md-4"),
+                                # Second row of filters
                                 html.Div([
-                                    html.Label("Visualization Type", className="form-label"),
-                                    dcc.RadioItems(
-                                        id='viz-type',
-                                        options=[
-                                            {'label': 'Bar Chart', 'value': 'bar'},
-                                            {'label': 'Histogram', 'value': 'histogram'},
-                                            {'label': 'Box Plot', 'value': 'box'},
-                                            {'label': 'Scatter', 'value': 'scatter'},
-                                            {'label': 'Pie Chart', 'value': 'pie'}
-                                        ],
-                                        value='bar',
-                                        className="btn-group",
-                                        inputClassName="btn-check",
-                                        labelClassName="btn btn-outline-primary",
-                                        labelStyle={'display': 'inline-block', 'marginRight': '10px'}
-                                    )
-                                ], className="col-md-4")
-                            ], className="row g-3 mb-3"),
+                                    html.Div([
+                                        html.Label("Distribution Channel", className="form-label"),
+                                        dcc.Dropdown(
+                                            id='channel',
+                                            options=CHANNEL_OPTIONS,
+                                            value='all',
+                                            className="form-select"
+                                        )
+                                    ], className="col-md-4"),
+                                    html.Div([
+                                        html.Label("Price Range", className="form-label"),
+                                        dcc.RangeSlider(
+                                            id='price-range',
+                                            min=0,
+                                            max=PRICE_MAX,
+                                            value=[0, PRICE_MAX],
+                                            marks={0: '$0', int(PRICE_MAX): f'${int(PRICE_MAX)}'},
+                                            tooltip={"placement": "bottom", "always_visible": True}
+                                        )
+                                    ], className="col-md-4"),
+                                    html.Div([
+                                        html.Label("Visualization Type", className="form-label"),
+                                        dcc.RadioItems(
+                                            id='viz-type',
+                                            options=[
+                                                {'label': 'Bar Chart', 'value': 'bar'},
+                                                {'label': 'Histogram', 'value': 'histogram'},
+                                                {'label': 'Box Plot', 'value': 'box'},
+                                                {'label': 'Scatter', 'value': 'scatter'},
+                                                {'label': 'Pie Chart', 'value': 'pie'}
+                                            ],
+                                            value='bar',
+                                            className="btn-group",
+                                            inputClassName="btn-check",
+                                            labelClassName="btn btn-outline-primary",
+                                            labelStyle={'display': 'inline-block', 'marginRight': '10px'}
+                                        )
+                                    ], className="col-md-4")
+                                ], className="row g-3 mb-3"),
                             
-                            # Buttons
-                            html.Div([
-                                html.Button("Apply Filters", id="apply-filters", className="btn btn-primary me-2"),
-                                html.Button("Reset Filters", id="reset-filters", className="btn btn-secondary")
-                            ], className="col-12")
-                        ], className="row g-3")
-                    ], className="card-body")
-                ], className="card shadow")
-            ], className="col-12")
-        ], className="row mb-3"),
+                                # Buttons
+                                html.Div([
+                                    html.Button("Apply Filters", id="apply-filters", className="btn btn-primary me-2"),
+                                    html.Button("Reset Filters", id="reset-filters", className="btn btn-secondary"),
+                                    # Filters last applied, shared by the output callbacks
+                                    dcc.Store(id='filters-store')
+                                ], className="col-12")
+                            ], className="row g-3")
+                        ], className="card-body")
+                    ], className="card shadow")
+                ], className="col-12")
+            ], className="row mb-3"),
         
-        # Main visualization and data table
-        html.Div([
-            # Visualization card
+            # Main visualization and data table
             html.Div([
+                # Visualization card
                 html.Div([
                     html.Div([
-                        html.H5("Data Visualization", className="mb-0"),
                         html.Div([
-                            html.A([
-                                html.I(className="bi bi-download"),
-                                " Download"
-                            ], id="download-chart", className="btn btn-sm btn-outline-primary me-2"),
-                            dcc.Download(id="download-chart-file")
-                        ], className="btn-group")
-                    ], className="card-header d-flex justify-content-between align-items-center"),
-                    html.Div([
-                        dcc.Loading(
-                            id="loading-visualization",
-                            type="circle",
-                            children=html.Div(id="visualization-container", style={"height": "400px"})
-                        )
-                    ], className="card-body")
-                ], className="card shadow mb-3")
-            ], className="col-md-8"),
+                            html.H5("Data Visualization", className="mb-0"),
+                            html.Div([
+                                html.A([
+                                    html.I(className="bi bi-download"),
+                                    " Download"
+                                ], id="download-chart", className="btn btn-sm btn-outline-primary me-2"),
+                                dcc.Download(id="download-chart-file")
+                            ], className="btn-group")
+                        ], className="card-header d-flex justify-content-between align-items-center"),
+                        html.Div([
+                            dcc.Loading(
+                                id="loading-visualization",
+                                type="circle",
+                                children=html.Div(id="visualization-container", style={"height": "400px"})
+                            )
+                        ], className="card-body")
+                    ], className="card shadow mb-3")
+                ], className="col-md-8"),
             
-            # Advanced analytics card
-            html.Div([
+                # Advanced analytics card
                 html.Div([
-                    html.Div([
-                        html.H5("Advanced Analytics", className="mb-0")
-                    ], className="card-header"),
                     html.Div([
                         html.Div([
-                            html.A([
-                                html.Div([
-                                    html.H6("Price Anomaly Detection", className="mb-1"),
-                                    html.Small("Find unusually priced medications", className="text-muted"),
-                                ]),
-                                html.Span("ML", className="badge bg-primary rounded-pill")
-                            ], href="#anomaly-section", id="show-anomaly", className="list-group-item list-group-item-action d-flex justify-content-between align-items-center"),
-                            html.A([
-                                html.Div([
-                                    html.H6("Price Clustering", className="mb-1"),
-                                    html.Small("Group medications by price segments", className="text-muted"),
-                                ]),
-                                html.Span("ML", className="badge bg-primary rounded-pill")
-                            ], href="#clustering-section", id="show-clustering", className="list-group-item list-group-item-action d-flex justify-content-between align-items-center")
-                        ], className="list-group")
-                    ], className="card-body")
-                ], className="card shadow mb-3"),
+                            html.H5("Advanced Analytics", className="mb-0")
+                        ], className="card-header"),
+                        html.Div([
+                            html.Div([
+                                html.A([
+                                    html.Div([
+                                        html.H6("Price Anomaly Detection", className="mb-1"),
+                                        html.Small("Find unusually priced medications", className="text-muted"),
+                                    ]),
+                                    html.Span("ML", className="badge bg-primary rounded-pill")
+                                ], href="#anomaly-section", id="show-anomaly", className="list-group-item list-group-item-action d-flex justify-content-between align-items-center"),
+                                html.A([
+                                    html.Div([
+                                        html.H6("Price Clustering", className="mb-1"),
+                                        html.Small("Group medications by price segments", className="text-muted"),
+                                    ]),
+                                    html.Span("ML", className="badge bg-primary rounded-pill")
+                                ], href="#clustering-section", id="show-clustering", className="list-group-item list-group-item-action d-flex justify-content-between align-items-center")
+                            ], className="list-group")
+                        ], className="card-body")
+                    ], className="card shadow mb-3"),
                 
-                # Summary statistics card
-                html.Div([
-                    html.Div([
-                        html.H5("Summary Statistics", className="mb-0")
-                    ], className="card-header"),
+                    # Summary statistics card
                     html.Div([
-                        html.Div(id="summary-stats", children="Select filters and apply to see statistics.")
-                    ], className="card-body")
-                ], className="card shadow")
-            ], className="col-md-4")
-        ], className="row mb-3"),
+                        html.Div([
+                            html.H5("Summary Statistics", className="mb-0")
+                        ], className="card-header"),
+                        html.Div([
+                            html.Div(id="summary-stats", children="Select filters and apply to see statistics.")
+                        ], className="card-body")
+                    ], className="card shadow")
+                ], className="col-md-4")
+            ], className="row mb-3"),
         
-        # Data table
-        html.Div([
+            # Data table
             html.Div([
                 html.Div([
                     html.Div([
-                        html.H5("Data Table", className="mb-0"),
                         html.Div([
-                            html.A([
-                                html.I(className="bi bi-download"),
-                                " Export"
-                            ], id="download-data", className="btn btn-sm btn-outline-primary"),
-                            dcc.Download(id="download-data-file")
-                        ], className="btn-group")
-                    ], className="card-header d-flex justify-content-between align-items-center"),
-                    html.Div([
-                        dcc.Loading(
-                            id="loading-table",
-                            type="circle",
-                            children=html.Div(id="data-table")
-                        )
-                    ], className="card-body")
-                ], className="card shadow")
-            ], className="col-12")
-        ], className="row mb-3"),
+                            html.H5("Data Table", className="mb-0"),
+                            html.Div([
+                                html.A([
+                                    html.I(className="bi bi-download"),
+                                    " Export"
+                                ], id="download-data", className="btn btn-sm btn-outline-primary"),
+                                dcc.Download(id="download-data-file")
+                            ], className="btn-group")
+                        ], className="card-header d-flex justify-content-between align-items-center"),
+                        html.Div([
+                            dcc.Loading(
+                                id="loading-table",
+                                type="circle",
+                                children=html.Div(id="data-table")
+                            )
+                        ], className="card-body")
+                    ], className="card shadow")
+                ], className="col-12")
+            ], className="row mb-3"),
         
-        # ML sections (initially hidden)
-        html.Div(id="anomaly-section", style={'display': 'none'}),
-        html.Div(id="clustering-section", style={'display': 'none'})
+            # ML sections (initially hidden)
+            html.Div(id="anomaly-section", style={'display': 'none'}),
+            html.Div(id="clustering-section", style={'display': 'none'})
         
-    ], className="container-fluid py-3")
-])
+        ], className="container-fluid py-3")
+    ])
+
+app.layout = build_layout
 
-# Callback to filter and display data
+# Callback to record the filters when they are applied or reset
 @app.callback(
-    [Output('visualization-container', 'children'),
-     Output('data-table', 'children'),
-     Output('summary-stats', 'children')],
+    [Output('filters-store', 'data'),
+     Output('viz-type', 'value')],
     [Input('apply-filters', 'n_clicks'),
      Input('reset-filters', 'n_clicks')],
     [State('active-ingredient', 'value'),
      State('manufacturer', 'value'),
      State('concentration', 'value'),
      State('channel', 'value'),
-     State('price-range', 'value'),
-     State('viz-type', 'value')]
+     State('price-range', 'value')]
 )
-def update_data(apply_clicks, reset_clicks, active_ingredient, manufacturer, concentration, channel, price_range, viz_type):
+def update_filters(apply_clicks, reset_clicks, active_ingredient, manufacturer, concentration, channel, price_range):
     # Get triggered button
     ctx = dash.callback_context
     trigger_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
     
     # Reset filters if reset button clicked
+    viz_type = dash.no_update
     if trigger_id == 'reset-filters':
         active_ingredient = 'all'
         manufacturer = 'all'
         concentration = 'all'
         channel = 'all'
-        price_range = [0, df['precio_por_tableta'].max()]
+        price_range = [0, PRICE_MAX]
         viz_type = 'bar'
     
-    # Filter data using data service
+    return normalize_filters(active_ingredient, manufacturer, concentration, channel, price_range), viz_type
+
+# Function to turn the filter control values into filtered_data() arguments
+def normalize_filters(active_ingredient, manufacturer, concentration, channel, price_range):
+    # 'all' means no filter on that column
     if active_ingredient == 'all':
         active_ingredient = None
     if manufacturer == 'all':
@@ -338,26 +373,91 @@ def update_data(apply_clicks, reset_clicks, active_ingredient, manufacturer, con
     if channel == 'all':
         channel = None
     
-    filtered_df = data_service.filter_data(
+    return [active_ingredient, manufacturer, concentration, channel, price_range[0], price_range[1]]
+
+# Callbacks to render each output from the stored filters, so changing the
+# visualization type only rebuilds the visualization
+@app.callback(
+    Output('visualization-container', 'children'),
+    [Input('filters-store', 'data'),
+     Input('viz-type', 'value')]
+)
+def update_visualization(filters, viz_type):
+    if filters is None:
+        raise dash.exceptions.PreventUpdate
+    return cached_visualization(tuple(filters), viz_type)
+
+@app.callback(
+    Output('data-table', 'children'),
+    Input('filters-store', 'data')
+)
+def update_table(filters):
+    if filters is None:
+        raise dash.exceptions.PreventUpdate
+    return cached_table(tuple(filters))
+
+@app.callback(
+    Output('summary-stats', 'children'),
+    Input('filters-store', 'data')
+)
+def update_stats(filters):
+    if filters is None:
+        raise dash.exceptions.PreventUpdate
+    return cached_stats(tuple(filters))
+
+# Functions to build the outputs, memoized since the data never changes and
+# re-applying the same filters is common
+@lru_cache(maxsize=128)
+def filtered_data(active_ingredient, manufacturer, concentration, channel, min_price, max_price):
+    return data_service.filter_data(
         active_ingredient=active_ingredient,
         manufacturer=manufacturer,
         concentration=concentration,
         channel=channel,
-        min_price=price_range[0],
-        max_price=price_range[1],
+        min_price=min_price,
+        max_price=max_price,
         limit=1000
     )
+
+@lru_cache(maxsize=128)
+def cached_visualization(filters, viz_type):
+    visualization = create_visualization(filtered_data(*filters), viz_type, filters[0])
+    # Keep the figure as plain JSON data so cache hits skip converting the Figure again
+    if isinstance(visualization, dcc.Graph):
+        visualization.figure = visualization.figure.to_plotly_json()
+    return visualization
+
+@lru_cache(maxsize=128)
+def cached_table(filters):
+    return create_data_table(filtered_data(*filters).head(50))
+
+@lru_cache(maxsize=128)
+def cached_stats(filters):
+    return create_summary_stats(filtered_data(*filters))
+
+# Function to pick about n_out row positions that keep the visible spread of a scatter
+# (every x value keeps its lowest and highest y, even past n_out)
+def downsample_xy(x, y, n_out=500):
+    if len(x) <= n_out:
+        return np.arange(len(x))
     
-    # Create visualization based on type
-    visualization = create_visualization(filtered_df, viz_type, active_ingredient)
-    
-    # Create data table
-    table = create_data_table(filtered_df.head(50))
-    
-    # Create summary statistics
-    stats = create_summary_stats(filtered_df)
+    # Order the points by x, then y, so every x value is one run sorted by y;
+    # the first and last point of each run (its lowest and highest y) are always kept
+    order = np.lexsort((y, x))
+    sorted_x = x[order]
+    starts = np.flatnonzero(np.r_[True, sorted_x[1:] != sorted_x[:-1]])
+    ends = np.r_[starts[1:], len(order)] - 1
+    envelope = np.zeros(len(order), dtype=bool)
+    envelope[starts] = envelope[ends] = True
     
-    return visualization, table, stats
+    # Min-max bucketing of the remaining points with what is left of the budget:
+    # split them into equal buckets and keep the first and last point of each
+    rest = order[~envelope]
+    n_buckets = min((n_out - np.count_nonzero(envelope)) // 2, len(rest))
+    keep = [order[envelope]]
+    if n_buckets > 0:
+        keep += [bucket[[0, -1]] for bucket in np.array_split(rest, n_buckets)]
+    return np.unique(np.concatenate(keep))
 
 # Function to create visualization based on type
 def create_visualization(df, viz_type, active_ingredient):
@@ -373,18 +473,36 @@ def create_visualization(df, viz_type, active_ingredient):
             # Otherwise group by active ingredient
             group_col = 'principio_activo'
         
-        # Group and calculate mean price
-        group_df = df.groupby(group_col)['precio_por_tableta'].mean().reset_index()
-        group_df = group_df.sort_values('precio_por_tableta', ascending=False).head(20)
+        # Mean price per group from two bincounts over the category codes
+        codes = df[group_col].cat.codes.to_numpy()
+        prices = df['precio_por_tableta'].to_numpy()
+        valid = codes >= 0
+        n_groups = len(df[group_col].cat.categories)
+        sums = np.bincount(codes[valid], weights=prices[valid], minlength=n_groups)
+        counts = np.bincount(codes[valid], minlength=n_groups)
         
-        fig = px.bar(
-            group_df, 
-            x=group_col, 
-            y='precio_por_tableta',
-            labels={'precio_por_tableta': 'Price per Tablet ($)', group_col: group_col.capitalize()},
+        # Keep the 20 present groups with the highest mean
+        present = np.flatnonzero(counts)
+        means = sums[present] / counts[present]
+        top = np.argsort(-means, kind='stable')[:20]
+        names = df[group_col].cat.categories[present[top]]
+        means = means[top]
+        
+        fig = go.Figure(go.Bar(
+            x=np.asarray(names),
+            y=means,
+            marker=dict(
+                color=means,
+                colorscale='Blues',
+                colorbar=dict(title='Price per Tablet ($)')
+            ),
+            hovertemplate=f'{group_col.capitalize()}=%{{x}}<br>Price per Tablet ($)=%{{y}}<extra></extra>'
+        ))
+        
+        fig.update_layout(
             title=f'Average Price by {group_col.capitalize()}',
-            color='precio_por_tableta',
-            color_continuous_scale='Blues'
+            xaxis_title=group_col.capitalize(),
+            yaxis_title='Price per Tablet ($)'
         )
         
         fig.update_layout(
@@ -396,16 +514,21 @@ def create_visualization(df, viz_type, active_ingredient):
         return dcc.Graph(figure=fig, style={'height': '100%'})
     
     elif viz_type == 'histogram':
-        fig = px.histogram(
-            df, 
-            x='precio_por_tableta', 
-            nbins=20,
-            labels={'precio_por_tableta': 'Price per Tablet ($)', 'count': 'Number of Products'},
-            title='Price Distribution Histogram',
-            color_discrete_sequence=['#3498db']
-        )
+        # Bin on the server so only the 20 bar heights are sent to the browser
+        counts, edges = np.histogram(df['precio_por_tableta'].to_numpy(), bins=20)
+        
+        fig = go.Figure(go.Bar(
+            x=(edges[:-1] + edges[1:]) / 2,
+            y=counts,
+            width=np.diff(edges),
+            marker_color='#3498db'
+        ))
         
         fig.update_layout(
+            title='Price Distribution Histogram',
+            xaxis_title='Price per Tablet ($)',
+            yaxis_title='Number of Products',
+            bargap=0,
             height=400,
             margin=dict(l=50, r=20, t=50, b=50)
         )
@@ -421,9 +544,14 @@ def create_visualization(df, viz_type, active_ingredient):
             # Otherwise group by active ingredient
             group_col = 'principio_activo'
         
-        # Limit to top groups by count for readability
-        top_groups = df[group_col].value_counts().head(10).index.tolist()
-        box_df = df[df[group_col].isin(top_groups)]
+        # Limit to the 10 most common groups overall that appear in the filtered rows,
+        # working on the category codes with the ranking computed at import
+        codes = df[group_col].cat.codes.to_numpy()
+        present = np.zeros(len(df[group_col].cat.categories), dtype=bool)
+        present[codes[codes >= 0]] = True
+        ranking = GROUP_RANKING[group_col]
+        top_codes = ranking[present[ranking]][:10]
+        box_df = df[np.isin(codes, top_codes)]
         
         fig = px.box(
             box_df, 
@@ -442,19 +570,34 @@ def create_visualization(df, viz_type, active_ingredient):
         return dcc.Graph(figure=fig, style={'height': '100%'})
     
     elif viz_type == 'scatter':
-        # Create scatter plot
-        fig = px.scatter(
-            df, 
-            x='fabricante', 
-            y='precio_por_tableta',
-            labels={'precio_por_tableta': 'Price per Tablet ($)', 'fabricante': 'Manufacturer'},
-            title='Price Scatter Plot',
-            color='precio_por_tableta',
-            color_continuous_scale='Blues',
-            hover_data=['nombre_comercial', 'principio_activo', 'concentracion']
+        # Thin out the points per manufacturer while keeping the price extremes
+        keep = downsample_xy(df['fabricante'].cat.codes.to_numpy(), df['precio_por_tableta'].to_numpy())
+        scatter_df = df.iloc[keep]
+        
+        # Build the hover label as one string column instead of three hover_data columns
+        hovertext = scatter_df['nombre_comercial'].str.cat(
+            [scatter_df['principio_activo'], scatter_df['concentracion']], sep='<br>', na_rep=''
         )
+        prices = scatter_df['precio_por_tableta'].to_numpy()
+        
+        # Create a WebGL scatter straight from the NumPy arrays
+        fig = go.Figure(go.Scattergl(
+            x=scatter_df['fabricante'].to_numpy(),
+            y=prices,
+            mode='markers',
+            marker=dict(
+                color=prices,
+                colorscale='Blues',
+                colorbar=dict(title='Price per Tablet ($)')
+            ),
+            text=hovertext.to_numpy(),
+            hovertemplate='<b>%{text}</b><br><br>Manufacturer=%{x}<br>Price per Tablet ($)=%{y}<extra></extra>'
+        ))
         
         fig.update_layout(
+            title='Price Scatter Plot',
+            xaxis_title='Manufacturer',
+            yaxis_title='Price per Tablet ($)',
             xaxis_tickangle=-45,
             height=400,
             margin=dict(l=50, r=20, t=50, b=100)
@@ -471,8 +614,8 @@ def create_visualization(df, viz_type, active_ingredient):
             # Otherwise group by active ingredient
             group_col = 'principio_activo'
         
-        # Group and count
-        group_counts = df[group_col].value_counts().reset_index()
+        # Group and count, leaving out categories absent from the filtered rows
+        group_counts = df[group_col].cat.remove_unused_categories().value_counts().reset_index()
         group_counts.columns = [group_col, 'count']
         
         # Limit to top 10 groups for readability
@@ -500,17 +643,19 @@ def create_data_table(df):
     if df.empty:
         return html.Div("No data available for the selected filters.", className="text-center p-5")
     
-    # Create a Dash DataTable
+    columns = [
+        {"name": "Name", "id": "nombre_comercial"},
+        {"name": "Active Ingredient", "id": "principio_activo"},
+        {"name": "Manufacturer", "id": "fabricante"},
+        {"name": "Concentration", "id": "concentracion"},
+        {"name": "Price", "id": "precio_por_tableta", "type": "numeric", "format": {"specifier": "$.2f"}}
+    ]
+    
+    # Create a Dash DataTable, only converting the columns it displays
     table = dash_table.DataTable(
         id='table',
-        columns=[
-            {"name": "Name", "id": "nombre_comercial"},
-            {"name": "Active Ingredient", "id": "principio_activo"},
-            {"name": "Manufacturer", "id": "fabricante"},
-            {"name": "Concentration", "id": "concentracion"},
-            {"name": "Price", "id": "precio_por_tableta", "type": "numeric", "format": {"specifier": "$.2f"}}
-        ],
-        data=df.to_dict('records'),
+        columns=columns,
+        data=df[[column["id"] for column in columns]].to_dict('records'),
         page_size=10,
         style_table={'overflowX': 'auto'},
         style_header={
@@ -538,12 +683,13 @@ def create_summary_stats(df):
     if df.empty:
         return html.Div("No data available for the selected filters.", className="text-center p-5")
     
-    # Calculate statistics
-    count = len(df)
-    min_price = df['precio_por_tableta'].min()
-    max_price = df['precio_por_tableta'].max()
-    avg_price = df['precio_por_tableta'].mean()
-    median_price = df['precio_por_tableta'].median()
+    # Calculate statistics on the raw price array (rows without a price were dropped at load)
+    prices = df['precio_por_tableta'].to_numpy()
+    count = prices.size
+    min_price = prices.min()
+    max_price = prices.max()
+    avg_price = prices.mean()
+    median_price = np.median(prices)
     
     # Create HTML table for statistics
     stats = html.Div([
@@ -560,27 +706,29 @@ def create_summary_stats(df):
     
     return stats
 
-# Callback for showing anomaly detection section
-@app.callback(
+# Toggling the anomaly and clustering sections is a pure style change, so it
+# runs in the browser without a round trip to the server
+SHOW_SECTION_JS = """
+function(n_clicks) {
+    return n_clicks ? {'display': 'block'} : {'display': 'none'};
+}
+"""
+
+# Clientside callback for showing anomaly detection section
+app.clientside_callback(
+    SHOW_SECTION_JS,
     Output('anomaly-section', 'style'),
     Input('show-anomaly', 'n_clicks'),
     prevent_initial_call=True
 )
-def show_anomaly_section(n_clicks):
-    if n_clicks:
-        return {'display': 'block'}
-    return {'display': 'none'}
 
-# Callback for showing clustering section
-@app.callback(
+# Clientside callback for showing clustering section
+app.clientside_callback(
+    SHOW_SECTION_JS,
     Output('clustering-section', 'style'),
     Input('show-clustering', 'n_clicks'),
     prevent_initial_call=True
 )
-def show_clustering_section(n_clicks):
-    if n_clicks:
-        return {'display': 'block'}
-    return {'display': 'none'}
 
 # Callback for downloading chart
 @app.callback(
@@ -598,36 +746,29 @@ def download_chart(n_clicks):
 @app.callback(
     Output('download-data-file', 'data'),
     Input('download-data', 'n_clicks'),
-    [State('active-ingredient', 'value'),
+    [State('filters-store', 'data'),
+     State('active-ingredient', 'value'),
      State('manufacturer', 'value'),
      State('concentration', 'value'),
      State('channel', 'value'),
      State('price-range', 'value')],
     prevent_initial_call=True
 )
-def download_data(n_clicks, active_ingredient, manufacturer, concentration, channel, price_range):
-    # Convert 'all' to None for data service
-    if active_ingredient == 'all':
-        active_ingredient = None
-    if manufacturer == 'all':
-        manufacturer = None
-    if concentration == 'all':
-        concentration = None
-    if channel == 'all':
-        channel = None
-    
-    # Filter data using data service
-    filtered_df = data_service.filter_data(
-        active_ingredient=active_ingredient,
-        manufacturer=manufacturer,
-        concentration=concentration,
-        channel=channel,
-        min_price=price_range[0],
-        max_price=price_range[1]
-    )
+def download_data(n_clicks, filters, active_ingredient, manufacturer, concentration, channel, price_range):
+    # Export the rows behind the current view, reusing the cached filter result;
+    # the controls are only read if no filters have been stored yet
+    if filters is None:
+        filters = normalize_filters(active_ingredient, manufacturer, concentration, channel, price_range)
+    filtered_df = filtered_data(*filters)
     
     # Return CSV download
-    return dcc.send_data_frame(filtered_df.to_csv, "drug_prices_filtered.csv")
+    return dict(content=to_csv_text(filtered_df), filename="drug_prices_filtered.csv")
+
+# Function to write a frame as CSV text with Arrow's multithreaded C++ writer
+def to_csv_text(df):
+    buffer = io.BytesIO()
+    pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buffer)
+    return buffer.getvalue().decode('utf-8')
 
 # Run the app
 if __name__ == '__main__':
@@ -1,9 +1,43 @@
 import pandas as pd
 import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 import os
+from functools import lru_cache
+
+# Derived frames never write into the loaded data, so its buffers stay
+# shared with forked server workers
+pd.set_option('mode.copy_on_write', True)
+
+# Columns that can be filtered by exact value, keyed by filter parameter name
+EQUALITY_FILTERS = {
+    'active_ingredient': 'principio_activo',
+    'manufacturer': 'fabricante',
+    'concentration': 'concentracion',
+    'channel': 'canal',
+    'dispensing_unit': 'unidad_de_dispensacion'
+}
+
+# Text columns with many repeated values, stored as categoricals
+CATEGORY_COLUMNS = [*EQUALITY_FILTERS.values(), 'nombre_comercial', 'fecha_corte']
+
+# Columns of the product records the model endpoints return
+PRODUCT_COLUMNS = ['nombre_comercial', 'principio_activo', 'fabricante', 'precio_por_tableta']
+
+EMPTY_INDEX = np.empty(0, dtype=np.intp)
+
+# Version of the table read_csv produces, stored in the Arrow cache; bump it
+# whenever that changes so caches written by older code are rebuilt
+CACHE_FORMAT = b'4'
+
+# Column of the cached table holding each row's number in the CSV
+ROW_COLUMN = '__csv_row__'
+
+# Largest filter_data limit whose result positions are memoized; the memo holds
+# 1024 parameter sets, so this caps it at about 8 MB (unlimited results, which
+# can be as long as the dataset, are always recomputed)
+MAX_CACHED_LIMIT = 1000
 
 class DataService:
     """
@@ -14,241 +48,633 @@ class DataService:
         """Initialize the data service and load the data"""
         self.DATA_FILE = data_file
         self.df = self.load_data()
+        self.build_indexes()
+        # Memos are per instance so they go away with it: the positions of small
+        # (limited) filter results, and the prices and fits of the models
+        self._cached_positions = lru_cache(maxsize=1024)(self._sorted_positions)
+        self._model_prices = lru_cache(maxsize=256)(self._model_prices)
+        self._fit_kmeans = lru_cache(maxsize=256)(self._fit_kmeans)
+        self._detect_anomalies = lru_cache(maxsize=256)(self._detect_anomalies)
     
     def load_data(self):
-        """Load data from CSV file"""
+        """Load data from CSV file (through its Arrow cache)"""
         if os.path.exists(self.DATA_FILE):
-            df = pd.read_csv(self.DATA_FILE, encoding='utf-8')
-            # Convert price column to numeric, handling errors
-            df['precio_por_tableta'] = pd.to_numeric(df['precio_por_tableta'], errors='coerce')
-            # Drop rows with NaN prices
-            df = df.dropna(subset=['precio_por_tableta'])
+            table = self.read_table()
+            # Strings stay Arrow-backed and numeric columns become NumPy columns,
+            # both without copying out of the memory-mapped cache where possible
+            df = table.to_pandas(types_mapper=self._arrow_string_dtype, split_blocks=True, self_destruct=True)
+            del table
+            # The CSV row numbers of the rows kept become the index (the row ids of the API)
+            if ROW_COLUMN in df.columns:
+                df = df.set_index(ROW_COLUMN).rename_axis(None)
             print(f"Loaded {len(df)} records from {self.DATA_FILE}")
             return df
         else:
             print(f"Warning: {self.DATA_FILE} not found")
             return pd.DataFrame()
     
-    def filter_data(self, active_ingredient=None, manufacturer=None, concentration=None, 
-                   channel=None, dispensing_unit=None, min_price=None, max_price=None,
-                   sort_by='precio_por_tableta', sort_order='asc', limit=50):
-        """Filter the dataset based on parameters"""
-        filtered_df = self.df.copy()
+    def read_table(self):
+        """Read the dataset as an Arrow table, preferring an up-to-date Arrow IPC copy of the CSV"""
+        arrow_file = self.DATA_FILE + '.arrow'
+        if os.path.exists(arrow_file) and os.path.getmtime(arrow_file) >= os.path.getmtime(self.DATA_FILE):
+            # Memory-map the uncompressed file: columns are read in place, and every
+            # process loading the dataset shares the same pages of the OS page cache
+            try:
+                reader = pa.ipc.open_file(pa.memory_map(arrow_file))
+                if (reader.schema.metadata or {}).get(b'cache_format') == CACHE_FORMAT:
+                    return reader.read_all()
+            except (OSError, pa.ArrowInvalid) as e:
+                print(f"Warning: ignoring unreadable {arrow_file}: {e}")
         
-        if active_ingredient:
-            filtered_df = filtered_df[filtered_df['principio_activo'] == active_ingredient]
+        table = self.read_csv()
         
-        if manufacturer:
-            filtered_df = filtered_df[filtered_df['fabricante'] == manufacturer]
+        # Cache the parsed table so later starts skip CSV parsing; write to a
+        # temporary name first so a concurrent reader never sees a partial file
+        # (one per process, as the API and dashboard may both build it at once)
+        tmp_file = f'{arrow_file}.{os.getpid()}.tmp'
+        try:
+            cached = table.replace_schema_metadata({b'cache_format': CACHE_FORMAT})
+            with pa.OSFile(tmp_file, 'wb') as sink, pa.ipc.new_file(sink, cached.schema) as writer:
+                writer.write_table(cached)
+            os.replace(tmp_file, arrow_file)
+        except OSError as e:
+            print(f"Warning: could not write {arrow_file}: {e}")
+        finally:
+            # Leave no partial file behind when the write failed
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        return table
+    
+    def read_csv(self):
+        """Parse the CSV file into an Arrow table"""
+        # Parse with Arrow (multi-threaded) so strings stay in Arrow buffers; the known
+        # text columns are declared as strings so their type is never inferred, and
+        # prices are read as text too so one malformed cell cannot fail the whole parse
+        table = pacsv.read_csv(
+            self.DATA_FILE,
+            read_options=pacsv.ReadOptions(encoding='utf-8', use_threads=True),
+            convert_options=pacsv.ConvertOptions(
+                column_types=dict.fromkeys(['precio_por_tableta', *CATEGORY_COLUMNS], pa.string()),
+                strings_can_be_null=True
+            )
+        )
+        # Number the rows as in the CSV, then drop the ones without a usable price, so
+        # the cached table holds exactly the rows served and loads without a copy
+        table = table.append_column(ROW_COLUMN, pa.array(np.arange(table.num_rows, dtype=np.int64)))
+        i = table.schema.get_field_index('precio_por_tableta')
+        if i >= 0:
+            prices = self._to_prices(table.column(i))
+            table = table.set_column(i, 'precio_por_tableta', prices)
+            table = table.filter(pc.invert(pc.is_null(prices, nan_is_null=True)))
+        # Keep inferred date columns as their original text
+        for i, field in enumerate(table.schema):
+            if pa.types.is_temporal(field.type):
+                table = table.set_column(i, field.name, table.column(i).cast(pa.string()))
+        # Dictionary-encode the repetitive text columns once here (after dropping rows,
+        # so only values still present are categories), so they are cached encoded
+        # and load straight into pandas categoricals
+        for column in CATEGORY_COLUMNS:
+            i = table.schema.get_field_index(column)
+            if i >= 0:
+                table = table.set_column(i, column, self._sorted_dictionary(table.column(i)))
+        return table.combine_chunks()
+    
+    @staticmethod
+    def _to_prices(column):
+        """Convert a string column to float64, turning values that are not numbers into nulls"""
+        try:
+            # Well-formed columns convert in C++
+            return pc.cast(column, pa.float64())
+        except pa.ArrowInvalid:
+            # Otherwise coerce value by value, as pd.to_numeric(errors='coerce') does
+            prices = pd.to_numeric(column.to_pandas(), errors='coerce')
+            return pa.array(prices, type=pa.float64(), from_pandas=True)
+    
+    @staticmethod
+    def _sorted_dictionary(column):
+        """Dictionary-encode an Arrow column with its distinct values in sorted order"""
+        values = column.combine_chunks()
+        categories = pc.unique(values).drop_null()
+        categories = categories.take(pc.array_sort_indices(categories))
+        return pa.DictionaryArray.from_arrays(pc.index_in(values, value_set=categories), categories)
+    
+    @staticmethod
+    def _arrow_string_dtype(arrow_type):
+        """Map Arrow string columns to pandas ArrowDtype, leaving other types to the default"""
+        if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+            return pd.ArrowDtype(arrow_type)
+        return None
+    
+    def build_indexes(self):
+        """Precompute a price-sorted order and the price ranks of the rows per filter value"""
+        self.filter_index = {}
+        self.prices = np.empty(0, dtype=np.float64)
+        self.price_order = EMPTY_INDEX
+        self.price_sorted = np.empty(0, dtype=np.float64)
+        if self.df.empty:
+            return
+        
+        # Row positions ordered by price, for binary-searched range filters
+        self.prices = self.df['precio_por_tableta'].to_numpy(dtype=np.float64)
+        self.price_order = np.argsort(self.prices, kind='stable')
+        self.price_sorted = self.prices[self.price_order]
+        
+        # For every distinct value of the equality-filter columns, the sorted price
+        # ranks of its rows, so a price range is a slice of each entry
+        rank = np.empty_like(self.price_order)
+        rank[self.price_order] = np.arange(len(rank))
+        for column in EQUALITY_FILTERS.values():
+            groups = self.df.groupby(column, sort=False, observed=True).indices
+            self.filter_index[column] = {value: np.sort(rank[rows]) for value, rows in groups.items()}
+    
+    @staticmethod
+    def _frozen(array):
+        """Mark `array` read-only and return it; cached arrays are shared between requests"""
+        array.flags.writeable = False
+        return array
+    
+    @staticmethod
+    def _ordered(values, descending=False, limit=None):
+        """Get the indices that stably order `values`, only ranking the first `limit` when given"""
+        keys = -values if descending else values
+        if limit is not None and 0 < limit < len(keys):
+            # Find the `limit`-th key in O(N) and take the rows before it, breaking ties on
+            # that boundary key by row order as the stable sort would, then sort just those
+            kth = np.partition(keys, limit - 1)[limit - 1]
+            if kth != kth:
+                # NaN keys sort last, so a NaN boundary means every other key comes before it
+                tied = np.isnan(keys)
+                below = ~tied
+            else:
+                below, tied = keys < kth, keys == kth
+            top = np.flatnonzero(below | (tied & (np.cumsum(tied) <= limit - np.count_nonzero(below))))
+            return top[np.argsort(keys[top], kind='stable')]
+        return np.argsort(keys, kind='stable')
+    
+    def _filter_positions(self, active_ingredient=None, manufacturer=None, concentration=None,
+                          channel=None, dispensing_unit=None, min_price=None, max_price=None,
+                          descending=False, limit=None):
+        """Get the positions of the rows matching every given filter, in price order"""
+        values = {
+            'active_ingredient': active_ingredient,
+            'manufacturer': manufacturer,
+            'concentration': concentration,
+            'channel': channel,
+            'dispensing_unit': dispensing_unit
+        }
         
-        if concentration:
-            filtered_df = filtered_df[filtered_df['concentracion'] == concentration]
+        # Price ranks matching all equality filters (None means all rows)
+        matches = [
+            self.filter_index[column].get(values[param], EMPTY_INDEX)
+            for param, column in EQUALITY_FILTERS.items() if values[param]
+        ]
+        ranks = None
+        for rows in sorted(matches, key=len):
+            ranks = rows if ranks is None else self._intersect_sorted(ranks, rows)
         
-        if channel:
-            filtered_df = filtered_df[filtered_df['canal'] == channel]
+        # The price range is a contiguous run of ranks, found by binary search
+        lo = 0 if min_price is None else np.searchsorted(self.price_sorted, min_price, side='left')
+        hi = len(self.price_sorted) if max_price is None else np.searchsorted(self.price_sorted, max_price, side='right')
+        if ranks is None:
+            ranks = np.arange(lo, hi)
+        else:
+            ranks = ranks[np.searchsorted(ranks, lo):np.searchsorted(ranks, hi)]
         
-        if dispensing_unit:
-            filtered_df = filtered_df[filtered_df['unidad_de_dispensacion'] == dispensing_unit]
+        # Ranks ascend with price, so the matches are already in price order
+        if descending:
+            if limit and 0 < limit < len(ranks):
+                # Only the top `limit` are needed: keep the ranks from the first one
+                # priced like the `limit`-th most expensive match
+                boundary = np.searchsorted(self.price_sorted, self.price_sorted[ranks[-limit]], side='left')
+                ranks = ranks[np.searchsorted(ranks, boundary):]
+            ranks = self._descending_ranks(ranks)
+        if limit:
+            ranks = ranks[:limit]
+        return self.price_order[ranks]
+    
+    def _descending_ranks(self, ranks):
+        """Reverse ascending price ranks, keeping equal-priced rows in row order as a stable sort does"""
+        # Flip the whole array, then flip every run of equal prices back
+        ranks = ranks[::-1]
+        prices = self.price_sorted[ranks]
+        starts = np.flatnonzero(np.r_[True, prices[1:] != prices[:-1]])
+        lengths = np.diff(np.r_[starts, len(ranks)])
+        run_starts = np.repeat(starts, lengths)
+        run_ends = np.repeat(starts + lengths - 1, lengths)
+        return ranks[run_starts + run_ends - np.arange(len(ranks))]
+    
+    @staticmethod
+    def _intersect_sorted(small, large):
+        """Get the values of sorted `small` that are also in sorted `large`, in O(len(small) log len(large))"""
+        if not len(small) or not len(large):
+            return EMPTY_INDEX
+        found = np.searchsorted(large, small).clip(max=len(large) - 1)
+        return small[large[found] == small]
+    
+    def filter_data(self, active_ingredient=None, manufacturer=None, concentration=None, 
+                   channel=None, dispensing_unit=None, min_price=None, max_price=None,
+                   sort_by='precio_por_tableta', sort_order='asc', limit=50, columns=None):
+        """Filter the dataset based on parameters, keeping only `columns` when given"""
+        params = (
+            active_ingredient, manufacturer, concentration, channel, dispensing_unit,
+            min_price, max_price, sort_by, sort_order.lower() != 'asc', limit
+        )
+        if limit is not None and 0 < limit <= MAX_CACHED_LIMIT:
+            positions = self._cached_positions(*params)
+        else:
+            positions = self._sorted_positions(*params)
+        # Selecting the columns first means only those are gathered row by row
+        df = self.df if columns is None else self.df[columns]
+        return df.take(positions)
+    
+    def _sorted_positions(self, active_ingredient, manufacturer, concentration, channel,
+                          dispensing_unit, min_price, max_price, sort_by, descending, limit):
+        """Get the positions of the rows filter_data returns"""
+        filters = dict(
+            active_ingredient=active_ingredient,
+            manufacturer=manufacturer,
+            concentration=concentration,
+            channel=channel,
+            dispensing_unit=dispensing_unit,
+            min_price=min_price,
+            max_price=max_price
+        )
         
-        if min_price is not None:
-            filtered_df = filtered_df[filtered_df['precio_por_tableta'] >= min_price]
+        # Sorting by price comes straight out of the price index
+        if sort_by == 'precio_por_tableta':
+            return self._frozen(self._filter_positions(**filters, descending=descending, limit=limit))
         
-        if max_price is not None:
-            filtered_df = filtered_df[filtered_df['precio_por_tableta'] <= max_price]
+        # Any other sort starts from the original row order
+        positions = np.sort(self._filter_positions(**filters))
         
-        # Apply sorting
-        if sort_by in filtered_df.columns:
-            filtered_df = filtered_df.sort_values(by=sort_by, ascending=(sort_order.lower() == 'asc'))
+        if sort_by in self.df.columns:
+            column = self.df[sort_by]
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                # Categories are sorted, so the codes rank like the values; missing
+                # values (code -1) are given the key that puts them last either way
+                keys = column.cat.codes.to_numpy()[positions].astype(np.int64)
+                keys[keys < 0] = -1 if descending else len(column.cat.categories)
+                positions = positions[self._ordered(keys, descending, limit)]
+            elif column.dtype.kind in 'if':
+                # Numeric columns are ranked on their NumPy values with a partial sort
+                positions = positions[self._ordered(column.to_numpy()[positions], descending, limit)]
+            else:
+                # Other columns are sorted by pandas, on just the matching values
+                values = column.iloc[positions].reset_index(drop=True)
+                order = values.sort_values(ascending=not descending, kind='stable').index.to_numpy()
+                positions = positions[order]
         
         # Apply limit
         if limit:
-            filtered_df = filtered_df.head(limit)
-            
-        return filtered_df
+            positions = positions[:limit]
+        
+        return self._frozen(positions)
+    
+    def get_metadata(self):
+        """Get the distinct filter values and overall price range of the dataset"""
+        prices = self.prices
+        return {
+            'total_records': len(self.df),
+            'active_ingredients': self.df['principio_activo'].dropna().unique().tolist(),
+            'manufacturers': self.df['fabricante'].dropna().unique().tolist(),
+            'concentrations': self.df['concentracion'].dropna().unique().tolist(),
+            'channels': self.df['canal'].dropna().unique().tolist(),
+            'dispensing_units': self.df['unidad_de_dispensacion'].dropna().unique().tolist(),
+            'price_range': {
+                'min': float(prices.min()),
+                'max': float(prices.max()),
+                'avg': float(prices.mean())
+            },
+            'columns': self.df.columns.tolist()
+        }
+    
+    @staticmethod
+    def _sample_std(values):
+        """Get the sample standard deviation (ddof=1, NaN for fewer than two values)"""
+        if len(values) < 2:
+            return float('nan')
+        return float(values.std(ddof=1))
+    
+    def _group_price_stats(self, df, group_by, name):
+        """Get count/min/max/mean of the price per group in one pass over integer group codes"""
+        column = df[group_by]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # The sorted categories already give integer codes, no need to hash the values again
+            codes, groups = column.cat.codes.to_numpy(), column.cat.categories
+        else:
+            codes, groups = pd.factorize(column, sort=True)
+        prices = df['precio_por_tableta'].to_numpy(dtype=np.float64)
+        
+        # Rows with a missing group key get code -1 and are left out, as in groupby
+        valid = codes >= 0
+        codes, prices = codes[valid], prices[valid]
+        
+        n_groups = len(groups)
+        counts = np.bincount(codes, minlength=n_groups)
+        sums = np.bincount(codes, weights=prices, minlength=n_groups)
+        mins = np.full(n_groups, np.inf)
+        np.minimum.at(mins, codes, prices)
+        maxs = np.full(n_groups, -np.inf)
+        np.maximum.at(maxs, codes, prices)
+        
+        # Categories absent from the filtered rows are not groups
+        present = counts > 0
+        counts, sums, mins, maxs = counts[present], sums[present], mins[present], maxs[present]
+        
+        return [
+            {name: group, 'count': count, 'min_price': min_price, 'max_price': max_price, 'avg_price': avg_price}
+            for group, count, min_price, max_price, avg_price in zip(
+                groups[present].tolist(), counts.tolist(), mins.tolist(), maxs.tolist(), (sums / counts).tolist()
+            )
+        ]
     
     def get_summary_stats(self, active_ingredient=None, manufacturer=None):
         """Get summary statistics based on filters"""
-        filtered_df = self.filter_data(active_ingredient=active_ingredient, manufacturer=manufacturer)
+        filtered_df = self.filter_data(
+            active_ingredient=active_ingredient, manufacturer=manufacturer,
+            columns=['precio_por_tableta', 'fabricante', 'principio_activo']
+        )
+        return self._summary_stats(filtered_df, active_ingredient, manufacturer)
+    
+    def _summary_stats(self, filtered_df, active_ingredient, manufacturer):
+        """Get summary statistics of already filtered rows, with the breakdowns the filters call for"""
+        # Calculate statistics on the raw price array; filter_data returns rows in
+        # price order, so the extremes and the median are read off by position and
+        # only the mean and standard deviation need a pass over the prices
+        prices = filtered_df['precio_por_tableta'].to_numpy(dtype=np.float64)
+        if len(prices) > 0:
+            middle = len(prices) // 2
+            price_stats = {
+                'min': float(prices[0]),
+                'max': float(prices[-1]),
+                'mean': float(prices.mean()),
+                'median': float(prices[middle] if len(prices) % 2 else (prices[middle - 1] + prices[middle]) / 2),
+                'std': self._sample_std(prices)
+            }
+        else:
+            price_stats = dict.fromkeys(['min', 'max', 'mean', 'median', 'std'], float('nan'))
         
-        # Calculate statistics
         stats = {
             'count': len(filtered_df),
-            'price_stats': {
-                'min': float(filtered_df['precio_por_tableta'].min()),
-                'max': float(filtered_df['precio_por_tableta'].max()),
-                'mean': float(filtered_df['precio_por_tableta'].mean()),
-                'median': float(filtered_df['precio_por_tableta'].median()),
-                'std': float(filtered_df['precio_por_tableta'].std())
-            }
+            'price_stats': price_stats
         }
         
         # Add manufacturer breakdown if active ingredient is specified
         if active_ingredient:
-            manufacturer_stats = filtered_df.groupby('fabricante').agg({
-                'precio_por_tableta': ['count', 'min', 'max', 'mean']
-            }).reset_index()
-            
-            manufacturer_stats.columns = ['manufacturer', 'count', 'min_price', 'max_price', 'avg_price']
-            stats['manufacturers'] = manufacturer_stats.to_dict(orient='records')
+            stats['manufacturers'] = self._group_price_stats(filtered_df, 'fabricante', 'manufacturer')
         
         # Add active ingredient breakdown if manufacturer is specified
         if manufacturer:
-            ingredient_stats = filtered_df.groupby('principio_activo').agg({
-                'precio_por_tableta': ['count', 'min', 'max', 'mean']
-            }).reset_index()
-            
-            ingredient_stats.columns = ['active_ingredient', 'count', 'min_price', 'max_price', 'avg_price']
-            stats['active_ingredients'] = ingredient_stats.to_dict(orient='records')
+            stats['active_ingredients'] = self._group_price_stats(filtered_df, 'principio_activo', 'active_ingredient')
             
         return stats
     
     def get_histogram_data(self, active_ingredient=None, manufacturer=None, bins=10):
         """Get histogram data for prices"""
-        filtered_df = self.filter_data(active_ingredient=active_ingredient, manufacturer=manufacturer)
+        filtered_df = self.filter_data(
+            active_ingredient=active_ingredient, manufacturer=manufacturer, columns=['precio_por_tableta']
+        )
+        return self._histogram_data(filtered_df, bins)
+    
+    @staticmethod
+    def _histogram_data(filtered_df, bins):
+        """Get histogram data for the prices of already filtered rows (in price order)"""
+        # Calculate histogram; filter_data returns rows in price order, so the
+        # price range is just the first and last value
+        prices = filtered_df['precio_por_tableta'].to_numpy(dtype=np.float64)
+        price_range = (prices[0], prices[-1]) if len(prices) else None
+        hist, bin_edges = np.histogram(prices, bins=bins, range=price_range)
         
-        # Calculate histogram
-        hist, bin_edges = np.histogram(filtered_df['precio_por_tableta'], bins=bins)
+        # Format labels and normalized counts for all bins at once
+        bin_starts, bin_ends = bin_edges[:-1], bin_edges[1:]
+        labels = np.char.add(np.char.add(np.char.mod('%.2f', bin_starts), ' - '), np.char.mod('%.2f', bin_ends))
+        normalized = hist / max(len(filtered_df), 1)
         
         # Format histogram data
-        histogram_data = []
-        for i in range(len(hist)):
-            histogram_data.append({
-                'bin': f"{bin_edges[i]:.2f} - {bin_edges[i+1]:.2f}",
-                'binStart': float(bin_edges[i]),
-                'binEnd': float(bin_edges[i+1]),
-                'count': int(hist[i]),
-                'normalizedCount': float(hist[i] / len(filtered_df)) if len(filtered_df) > 0 else 0
-            })
+        histogram_data = [
+            {'bin': label, 'binStart': start, 'binEnd': end, 'count': count, 'normalizedCount': norm}
+            for label, start, end, count, norm in zip(
+                labels.tolist(), bin_starts.tolist(), bin_ends.tolist(), hist.tolist(), normalized.tolist()
+            )
+        ]
             
         return histogram_data
     
     def get_boxplot_data(self, group_by='fabricante', active_ingredient=None, limit=10):
         """Get boxplot data grouped by a specific column"""
-        filtered_df = self.filter_data(active_ingredient=active_ingredient)
+        if group_by not in self.df.columns:
+            return {'error': f'Column {group_by} not found'}
         
+        # (dict.fromkeys avoids a duplicate column when grouping by the price itself)
+        filtered_df = self.filter_data(
+            active_ingredient=active_ingredient, columns=list(dict.fromkeys([group_by, 'precio_por_tableta']))
+        )
+        return self._boxplot_data(filtered_df, group_by, limit)
+    
+    def _boxplot_data(self, filtered_df, group_by, limit):
+        """Get boxplot data of already filtered rows grouped by `group_by`, a column they have"""
         # Group by the specified column
-        if group_by in filtered_df.columns:
-            # Calculate boxplot statistics for each group
-            boxplot_data = []
-            
-            # Group by the specified column
-            groups = filtered_df.groupby(group_by)
-            
-            # Process each group
-            for name, group in groups:
-                # Skip groups with too few data points
-                if len(group) < 5:
-                    continue
-                    
-                prices = group['precio_por_tableta'].sort_values()
-                
-                boxplot_data.append({
-                    'name': name,
-                    'min': float(prices.min()),
-                    'q1': float(prices.quantile(0.25)),
-                    'median': float(prices.median()),
-                    'q3': float(prices.quantile(0.75)),
-                    'max': float(prices.max()),
-                    'count': len(group)
-                })
-            
-            # Sort by median and limit results
-            boxplot_data.sort(key=lambda x: x['median'], reverse=True)
-            boxplot_data = boxplot_data[:limit]
-            
-            return boxplot_data
-        else:
+        codes, groups = pd.factorize(filtered_df[group_by], sort=True)
+        prices = filtered_df['precio_por_tableta'].to_numpy(dtype=np.float64)
+        
+        # Rows with a missing group key get code -1 and are left out, as in groupby
+        valid = codes >= 0
+        codes, prices = codes[valid], prices[valid]
+        
+        # Sort by group, then price, so every group is one sorted run
+        sorted_prices = prices[np.lexsort((prices, codes))]
+        counts = np.bincount(codes, minlength=len(groups))
+        starts = np.cumsum(counts) - counts
+        
+        # Skip groups with too few data points
+        keep = np.flatnonzero(counts >= 5)
+        starts, counts = starts[keep], counts[keep]
+        
+        # Read every statistic of every group straight off the sorted runs
+        q1, median, q3 = self._run_quantiles(sorted_prices, starts, counts, [0.25, 0.5, 0.75])
+        mins = sorted_prices[starts]
+        maxs = sorted_prices[starts + counts - 1]
+        
+        # Sort by median and limit results
+        top = np.argsort(-median, kind='stable')[:limit]
+        names = groups.take(keep[top]).tolist()
+        boxplot_data = [
+            {'name': name, 'min': min_price, 'q1': q1_price, 'median': median_price,
+             'q3': q3_price, 'max': max_price, 'count': count}
+            for name, min_price, q1_price, median_price, q3_price, max_price, count in zip(
+                names, mins[top].tolist(), q1[top].tolist(), median[top].tolist(),
+                q3[top].tolist(), maxs[top].tolist(), counts[top].tolist()
+            )
+        ]
+        
+        return boxplot_data
+    
+    @staticmethod
+    def _run_quantiles(sorted_values, starts, counts, q):
+        """Get the `q` quantiles (one row each) of every sorted run of `sorted_values`, interpolating linearly like pandas"""
+        h = (counts - 1) * np.asarray(q, dtype=np.float64)[:, None]
+        lower = np.floor(h).astype(np.intp)
+        upper = np.minimum(lower + 1, counts - 1)
+        below = sorted_values[starts + lower]
+        return below + (h - lower) * (sorted_values[starts + upper] - below)
+    
+    def analyze(self, active_ingredient=None, manufacturer=None, bins=10, group_by='fabricante', limit=10):
+        """Get summary statistics, histogram and boxplot data of the same filtered rows in one go"""
+        if group_by not in self.df.columns:
             return {'error': f'Column {group_by} not found'}
+        
+        # Filter once, with every column the three analyses read
+        filtered_df = self.filter_data(
+            active_ingredient=active_ingredient, manufacturer=manufacturer,
+            columns=list(dict.fromkeys(['precio_por_tableta', 'fabricante', 'principio_activo', group_by]))
+        )
+        
+        return {
+            'summary': self._summary_stats(filtered_df, active_ingredient, manufacturer),
+            'histogram': self._histogram_data(filtered_df, bins),
+            'boxplot': self._boxplot_data(filtered_df, group_by, limit)
+        }
     
-    def get_clustering(self, active_ingredient=None, n_clusters=3):
-        """Perform k-means clustering on the data"""
-        filtered_df = self.filter_data(active_ingredient=active_ingredient)
+    def _model_prices(self, active_ingredient):
+        """Get the prices the clustering and anomaly models work on, shared by both"""
+        filtered_df = self.filter_data(active_ingredient=active_ingredient, columns=['precio_por_tableta'])
+        return self._frozen(filtered_df['precio_por_tableta'].to_numpy(dtype=np.float64))
+    
+    def _fit_kmeans(self, active_ingredient, n_clusters, max_iter=300):
+        """Fit 1-D k-means on the filtered prices; returns (labels, centers in price units)"""
+        prices = self._model_prices(active_ingredient)
+        if n_clusters < 1 or len(prices) < n_clusters:
+            raise ValueError(f'Cannot form {n_clusters} clusters from {len(prices)} prices')
+        
+        # On a single feature every cluster is a contiguous run of the sorted
+        # prices, so a clustering is fully described by its run boundaries
+        # (filter_data returns rows in price order, which the stable sort passes over in linear time)
+        order = np.argsort(prices, kind='stable')
+        sorted_prices = prices[order]
+        cumulative = np.concatenate(([0.0], np.cumsum(sorted_prices)))
         
-        # Prepare data for clustering
-        X = filtered_df[['precio_por_tableta']].copy()
+        # Seed the centers at the midpoint quantiles of k equal-count buckets,
+        # then move each boundary to the midpoint between neighbouring centers
+        # until the runs stop changing
+        centers = np.quantile(sorted_prices, (np.arange(n_clusters) + 0.5) / n_clusters)
+        bounds = np.empty(n_clusters + 1, dtype=np.intp)
+        bounds[0], bounds[-1] = 0, len(sorted_prices)
+        bounds[1:-1] = np.searchsorted(sorted_prices, (centers[:-1] + centers[1:]) / 2, side='right')
+        if np.any(np.diff(bounds) == 0):
+            # Repeated prices can leave a seed bucket empty; fall back to equal counts
+            bounds = np.linspace(0, len(sorted_prices), n_clusters + 1).astype(np.intp)
+        for _ in range(max_iter):
+            centers = (cumulative[bounds[1:]] - cumulative[bounds[:-1]]) / np.diff(bounds)
+            new_bounds = bounds.copy()
+            new_bounds[1:-1] = np.searchsorted(sorted_prices, (centers[:-1] + centers[1:]) / 2, side='right')
+            # Stop before a run empties out (only possible with repeated prices)
+            if np.array_equal(new_bounds, bounds) or np.any(np.diff(new_bounds) == 0):
+                break
+            bounds = new_bounds
+        centers = (cumulative[bounds[1:]] - cumulative[bounds[:-1]]) / np.diff(bounds)
         
-        # Standardize features
-        scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(X)
+        labels = np.empty(len(prices), dtype=np.int32)
+        labels[order] = np.repeat(np.arange(n_clusters, dtype=np.int32), np.diff(bounds))
         
-        # Perform clustering
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-        filtered_df['cluster'] = kmeans.fit_predict(X_scaled)
+        return self._frozen(labels), self._frozen(centers)
+    
+    def _detect_anomalies(self, active_ingredient, contamination):
+        """Flag prices outside the IQR fences, farthest from the median first; returns -1 (anomaly) / 1 (normal) labels"""
+        if not 0 < contamination <= 0.5:
+            raise ValueError(f'contamination must be in (0, 0.5], got {contamination}')
+        
+        prices = self._model_prices(active_ingredient)
+        
+        # On a single feature the outliers are the prices beyond Tukey's fences
+        # (1.5 IQR past the quartiles); `contamination` caps the flagged fraction,
+        # keeping the ones with the largest absolute deviation from the median
+        n_anomalies = int(contamination * len(prices))
+        
+        predictions = np.ones(len(prices), dtype=np.int8)
+        if n_anomalies > 0:
+            q1, median, q3 = np.quantile(prices, [0.25, 0.5, 0.75])
+            fence = 1.5 * (q3 - q1)
+            deviation = np.abs(prices - median)
+            farthest = np.argpartition(-deviation, n_anomalies - 1)[:n_anomalies]
+            outside = (prices[farthest] < q1 - fence) | (prices[farthest] > q3 + fence)
+            predictions[farthest[outside]] = -1
+        
+        return self._frozen(predictions)
+    
+    @staticmethod
+    def _product_records(df, **extra):
+        """Build JSON records of the identifying columns of `df`'s rows plus the `extra` value lists"""
+        columns = {
+            'id': df.index.to_numpy().astype(int).tolist(),
+            'nombre_comercial': df['nombre_comercial'].tolist(),
+            'principio_activo': df['principio_activo'].tolist(),
+            'fabricante': df['fabricante'].tolist(),
+            'precio_por_tableta': df['precio_por_tableta'].to_numpy(dtype=float).tolist(),
+            **extra
+        }
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+    
+    def get_clustering(self, active_ingredient=None, n_clusters=3):
+        """Perform k-means clustering on the data"""
+        filtered_df = self.filter_data(active_ingredient=active_ingredient, columns=PRODUCT_COLUMNS)
+        
+        # Perform clustering (fitted models are cached per filter)
+        labels, centers = self._fit_kmeans(active_ingredient, n_clusters)
         
         # Calculate cluster statistics
+        prices = self._model_prices(active_ingredient)
         cluster_stats = []
         for i in range(n_clusters):
-            cluster_df = filtered_df[filtered_df['cluster'] == i]
+            cluster_prices = prices[labels == i]
             cluster_stats.append({
                 'cluster_id': int(i),
-                'count': int(len(cluster_df)),
-                'min_price': float(cluster_df['precio_por_tableta'].min()),
-                'max_price': float(cluster_df['precio_por_tableta'].max()),
-                'avg_price': float(cluster_df['precio_por_tableta'].mean()),
-                'center': float(kmeans.cluster_centers_[i][0] * scaler.scale_[0] + scaler.mean_[0])
+                'count': int(len(cluster_prices)),
+                'min_price': float(cluster_prices.min()),
+                'max_price': float(cluster_prices.max()),
+                'avg_price': float(cluster_prices.mean()),
+                'center': float(centers[i])
             })
         
-        # Add cluster information to the dataset
-        data_sample = []
-        for _, row in filtered_df.head(100).iterrows():
-            data_sample.append({
-                'id': int(row.name),
-                'nombre_comercial': row['nombre_comercial'],
-                'principio_activo': row['principio_activo'],
-                'fabricante': row['fabricante'],
-                'precio_por_tableta': float(row['precio_por_tableta']),
-                'cluster': int(row['cluster'])
-            })
-            
+        # Add cluster information to a sample of the dataset
+        sample_df = filtered_df.head(100)
+        data_sample = self._product_records(sample_df, cluster=labels[:len(sample_df)].astype(int).tolist())
+        
         return {
             'cluster_stats': cluster_stats,
             'data_sample': data_sample
         }
     
     def get_anomalies(self, active_ingredient=None, contamination=0.05):
-        """Detect price anomalies using Isolation Forest"""
-        filtered_df = self.filter_data(active_ingredient=active_ingredient)
+        """Detect price anomalies outside the interquartile range fences"""
+        filtered_df = self.filter_data(active_ingredient=active_ingredient, columns=PRODUCT_COLUMNS)
         
-        # Prepare data for anomaly detection
-        X = filtered_df[['precio_por_tableta']].copy()
+        # Perform anomaly detection (results are cached per filter)
+        predictions = self._detect_anomalies(active_ingredient, contamination)
         
-        # Standardize features
-        scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(X)
+        # -1 indicates anomaly, 1 indicates normal
+        is_anomaly = predictions == -1
+        prices = self._model_prices(active_ingredient)
         
-        # Perform anomaly detection
-        isolation_forest = IsolationForest(contamination=contamination, random_state=42)
-        filtered_df['anomaly'] = isolation_forest.fit_predict(X_scaled)
+        # Get anomalies, most expensive first
+        anomaly_positions = np.flatnonzero(is_anomaly)
+        anomalies = filtered_df.iloc[anomaly_positions[np.argsort(-prices[anomaly_positions], kind='stable')]]
         
-        # -1 indicates anomaly, 1 indicates normal
-        filtered_df['anomaly'] = filtered_df['anomaly'].map({1: 0, -1: 1})
-        
-        # Get anomalies
-        anomalies = filtered_df[filtered_df['anomaly'] == 1].sort_values('precio_por_tableta', ascending=False)
-        
-        # Format anomalies
-        anomaly_data = []
-        for _, row in anomalies.iterrows():
-            anomaly_data.append({
-                'id': int(row.name),
-                'nombre_comercial': row['nombre_comercial'],
-                'principio_activo': row['principio_activo'],
-                'fabricante': row['fabricante'],
-                'precio_por_tableta': float(row['precio_por_tableta']),
-                'is_anomaly': bool(row['anomaly'])
-            })
+        # Format anomalies (every selected row is flagged)
+        anomaly_data = self._product_records(anomalies, is_anomaly=[True] * len(anomalies))
         
-        # Calculate statistics
-        normal_prices = filtered_df[filtered_df['anomaly'] == 0]['precio_por_tableta']
-        anomaly_prices = filtered_df[filtered_df['anomaly'] == 1]['precio_por_tableta']
+        # Calculate statistics on the raw price array
+        normal_prices = prices[~is_anomaly]
+        anomaly_prices = prices[is_anomaly]
         
+        normal_avg = float(normal_prices.mean()) if len(normal_prices) > 0 else 0
+        normal_std = self._sample_std(normal_prices)
         stats = {
             'normal_count': int(len(normal_prices)),
             'anomaly_count': int(len(anomaly_prices)),
-            'normal_avg_price': float(normal_prices.mean()) if len(normal_prices) > 0 else 0,
+            'normal_avg_price': normal_avg,
             'anomaly_avg_price': float(anomaly_prices.mean()) if len(anomaly_prices) > 0 else 0,
-            'price_threshold_upper': float(normal_prices.mean() + 2 * normal_prices.std()) if len(normal_prices) > 0 else 0,
-            'price_threshold_lower': float(normal_prices.mean() - 2 * normal_prices.std()) if len(normal_prices) > 0 else 0
+            'price_threshold_upper': normal_avg + 2 * normal_std if len(normal_prices) > 0 else 0,
+            'price_threshold_lower': normal_avg - 2 * normal_std if len(normal_prices) > 0 else 0
         }
         
         return {
@@ -0,0 +1,9 @@
+# Gunicorn settings for the Flask API: gunicorn -c gunicorn.conf.py app:app
+
+bind = '0.0.0.0:5000'
+workers = 4
+
+# Load the app (and with it the dataset) once in the master process before
+# forking, so every worker shares the same read-only DataFrame pages instead
+# of parsing and holding its own copy
+preload_app = True
@@ -2,16 +2,21 @@ import subprocess
 import sys
 import os
 import argparse
+import signal
 
 def run_flask_api():
     """Run the Flask API backend"""
     print("Starting Flask API backend on port 5000...")
-    subprocess.Popen([sys.executable, "app.py"])
+    return subprocess.Popen([sys.executable, "app.py"])
 
 def run_dash_app():
     """Run the Dash visualization frontend"""
     print("Starting Dash visualization app on port 8050...")
-    subprocess.Popen([sys.executable, "dash_app.py"])
+    return subprocess.Popen([sys.executable, "dash_app.py"])
+
+def interrupt(signum, frame):
+    """Signal handler that raises KeyboardInterrupt"""
+    raise KeyboardInterrupt
 
 def main():
     parser = argparse.ArgumentParser(description="Run PharmaLens Application")
@@ -21,25 +26,32 @@ def main():
     args = parser.parse_args()
     
     if args.api_only:
-        run_flask_api()
+        processes = [run_flask_api()]
     elif args.dash_only:
-        run_dash_app()
+        processes = [run_dash_app()]
     else:
         # Run both by default
-        run_flask_api()
-        run_dash_app()
+        processes = [run_flask_api(), run_dash_app()]
     
     print("\nApplications are running:")
     print("- Flask API: http://localhost:5000")
     print("- Dash App: http://localhost:8050")
     print("\nPress Ctrl+C to stop all applications")
     
+    # Shut down the same way on SIGTERM as on Ctrl+C
+    signal.signal(signal.SIGTERM, interrupt)
+    
     try:
-        # Keep the script running
-        while True:
-            pass
+        # Sleep until the applications exit
+        for process in processes:
+            process.wait()
     except KeyboardInterrupt:
         print("\nShutting down applications...")
+        # Stop the children too, so they do not keep holding their ports
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
         sys.exit(0)
 
 if __name__ == "__main__":